@@ -13,15 +13,48 @@ Comments ("#" to the end of line) are allowed. Unicode characters can be specifi
 
 import argparse
 import codecs
+import functools
+import importlib.util
 import io
 import os
 import re
 import sys
+from typing import Iterator, Tuple
+
+# Aho-Corasick is optional; translate() uses a regex alternation without it and for small dictionaries
+try:
+    import ahocorasick
+    _HAS_AHOCORASICK = True
+except ImportError:
+    _HAS_AHOCORASICK = False
+
+# reportlab is only needed for pdf output; it is imported in create_pdf, as importing it is slow
+_HAS_REPORTLAB = importlib.util.find_spec('reportlab') is not None
 
 __version__ = '1.1'
 __author__ = 'TimB'
 __license__ = 'MIT'
 
+_FONTS_DIR = 'fonts/'
+
+# Minimum number of keys for which the Aho-Corasick automaton is faster than the regex alternation.
+# The automaton scans in C, but every match it reports is handled in Python.
+_AC_MIN_KEYS = 32
+
+# Escaped unicode characters (\u0000, \U00000000, \N{char_name})
+_UNICODE_ESC_RE = re.compile(r'(\\(?:u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|N{[^}]+}))')
+# Key-value pair "key / value # comment" (unstripped), lines starting with a comment or without delimiter do not match
+_KV_RE = re.compile(r'^([^#/\n]*)/([^#/\n]*)(?:#.*)?$', re.MULTILINE)
+_COMMENT_RE = re.compile('(^[ \t]*#.*\n)|(#.*$)', re.MULTILINE)
+# Text inside <> (group 1, without "cleartext" and language attribute) or inside [] (group 2)
+_TAG_RE = re.compile(r'<[ ]*(?:(?i:cleartext)(?:[ -][A-Z]{2})?[ -]*)?([^>]*)>|\[([^\]]*)\]')
+_LINEBREAK_RE = re.compile('\r*\n')
+_PAGE_SPLIT_RE = re.compile('(?:[\n][ \t]*){2,}')
+
+# Characters opening a part of the text that is not translated (cleartext tags and comments)
+_SEG_START_RE = re.compile(r'[<\[#]')
+_SEG_END = {'<': '>', '[': ']', '#': '\n'}
+
 
 def read_file(filename: str) -> str:
     """
@@ -34,8 +67,14 @@ def read_file(filename: str) -> str:
 
     try:
         with io.open(filename, encoding='utf-8', newline='') as f:
-            # Fix for inconsistent line breaks - all linebreaks are replaced with system default linebreaks
-            return re.sub('\r*\n', os.linesep, f.read())
+            data = f.read()
+        # Fix for inconsistent line breaks - all linebreaks are replaced with system default linebreaks.
+        # The regex is only needed if there are carriage returns, '\r\r\n' counts as a single linebreak.
+        if '\r' in data:
+            return _LINEBREAK_RE.sub(os.linesep, data)
+        if os.linesep != '\n':
+            return data.replace('\n', os.linesep)
+        return data
     except IOError as ex:
         print(ex)
         sys.exit(1)
@@ -73,18 +112,29 @@ def get_dictionary(dict_data: str, reverse: bool = False) -> dict:
     :return:            dictionary of translation key-value pairs
     """
 
+    # Copy, so changes made by the caller do not end up in the cache
+    return dict(_parse_dictionary(dict_data, reverse))
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_dictionary(dict_data: str, reverse: bool) -> dict:
+    """
+    Memoized implementation of get_dictionary, the returned dictionary must not be modified.
+
+    :param dict_data:   String containing the key-value pairs
+    :param reverse:     TRUE if the dict should be reversed
+    :return:            dictionary of translation key-value pairs
+    """
+
     # Un-escape escaped unicode characters (\u0000, \U00000000, \N{char_name}
-    dict_data = re.sub(r'(\\(?:u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|N{[^}]+}))',
-                       lambda l: codecs.decode(l.group(), 'unicode_escape'), dict_data)
+    dict_data = _UNICODE_ESC_RE.sub(lambda l: codecs.decode(l.group(), 'unicode_escape'), dict_data)
+
+    # _KV_RE only ends lines at '\n', normalise all other line boundaries (\r, \x0b, \u2028, ...)
+    dict_data = '\n'.join(dict_data.splitlines())
 
     kv_delimiter = '/'  # Character delimiting strings to be translated from and to
-    comment_delimiter = '#'
 
-    d = {}
-    for line in dict_data.splitlines():
-        if kv_delimiter in line and line[0] != comment_delimiter:  # Ignore comments and lines without delimiters
-            (k, v) = line.split(comment_delimiter)[0].split(kv_delimiter)
-            d[k.strip()] = v.strip()
+    d = {m.group(1).strip(): m.group(2).strip() for m in _KV_RE.finditer(dict_data)}
 
     if len(d) == 0:
         raise ValueError('Error: The dictionary does not have a valid format (no key-value pairs found).\n'
@@ -93,12 +143,114 @@ def get_dictionary(dict_data: str, reverse: bool = False) -> dict:
                                               'c' + kv_delimiter + 'd\n'
                                                                    '...')
 
+    # Reverse after parsing, so the reversed dict is the inverse of the forward dict (last pair for a key wins)
     if reverse:
         d = {v: k for k, v in d.items()}
 
     return d
 
 
+def _segment(text: str) -> Iterator[Tuple[bool, int, int]]:
+    """
+    Splits the text into spans to be translated and spans to be left unchanged, in a single pass.
+    Tags (<...> and [...]) are left unchanged including the brackets, comments from "#" to the end of the line.
+    An opening bracket without a closing bracket is treated as ordinary text.
+
+    :param text:    the text to be split
+    :return:        iterator of (translate, start, end) tuples covering the whole text
+    """
+
+    n = len(text)
+    start = 0  # Start of the current span to be translated
+    pos = 0  # Position to continue searching from
+    while True:
+        match = _SEG_START_RE.search(text, pos)
+        if match is None:
+            break
+        i = match.start()
+        opening = text[i]
+        end = text.find(_SEG_END[opening], i + 1)
+        if end == -1:
+            if opening != '#':
+                pos = i + 1
+                continue
+            end = n
+        elif opening != '#':
+            end += 1  # Include the closing bracket, but not the newline ending a comment
+        if i > start:
+            yield True, start, i
+        yield False, i, end
+        start = pos = end
+    if start < n:
+        yield True, start, n
+
+
+@functools.lru_cache(maxsize=16)
+def _build_pattern(items: tuple) -> 're.Pattern':
+    """
+    Compiles a regex matching the translation keys, sorted by key length (longest first).
+    Cached, so repeated translations with the same dictionary reuse the pattern.
+
+    :param items:   tuple of (key, value) pairs
+    :return:        compiled pattern
+    """
+
+    keys = sorted((k for k, v in items), key=len, reverse=True)
+    return re.compile('|'.join(map(re.escape, keys)))
+
+
+@functools.lru_cache(maxsize=16)
+def _build_automaton(items: tuple) -> 'ahocorasick.Automaton':
+    """
+    Builds an Aho-Corasick automaton from translation key-value pairs.
+    Cached, so repeated translations with the same dictionary reuse the automaton.
+
+    :param items:   tuple of (key, value) pairs
+    :return:        automaton mapping each key to (key length, value)
+    """
+
+    automaton = ahocorasick.Automaton()
+    for k, v in items:
+        automaton.add_word(k, (len(k), v))
+    automaton.make_automaton()
+    return automaton
+
+
+def _ac_substitute(segment: str, automaton: 'ahocorasick.Automaton') -> str:
+    """
+    Replaces every key found in the segment with its value, using the longest match at each position.
+
+    :param segment:     the text to be translated
+    :param automaton:   automaton built by _build_automaton
+    :return:            the translated segment
+    """
+
+    # Length and value of the longest key starting at each position, as parallel lists indexed by position.
+    # Automaton.iter_long is not used, as it can miss a shorter match inside a longer partial match.
+    n = len(segment)
+    lengths = [0] * n
+    values = [None] * n
+    for end, (klen, value) in automaton.iter(segment):
+        start = end - klen + 1
+        if klen > lengths[start]:
+            lengths[start] = klen
+            values[start] = value
+
+    parts = []
+    pos = 0
+    start = 0
+    while start < n:
+        klen = lengths[start]
+        if klen:
+            parts.append(segment[pos:start])
+            parts.append(values[start])
+            start = pos = start + klen
+        else:
+            start += 1
+    parts.append(segment[pos:])
+    return ''.join(parts)
+
+
 def translate(text: str, transdict: dict) -> str:
     """
     Translates the provided text using the translation dictionary.
@@ -110,21 +262,56 @@ def translate(text: str, transdict: dict) -> str:
     :return:            the translated text
     """
 
-    # Compile regex matching ciphertext keys from dictionary, sorted by key length (longest first)
-    ciphers_pattern = re.compile('|'.join(sorted(transdict.keys(), key=len, reverse=True)))
+    # Empty keys can never be matched
+    items = tuple((k, v) for k, v in transdict.items() if k)
+    if not items:
+        return text
+
+    return _translate(text, items)
+
+
+@functools.lru_cache(maxsize=128)
+def _translate(text: str, items: tuple) -> str:
+    """
+    Memoized implementation of translate, keyed on the text and the dictionary contents.
+
+    :param text:    the text to be translated
+    :param items:   tuple of (key, value) pairs
+    :return:        the translated text
+    """
+
+    if all(len(k) == 1 for k, v in items):
+        # Only single character keys: a translation table replaces them without any regex or automaton
+        table = str.maketrans(dict(items))
+
+        def substitute(segment):
+            return segment.translate(table)
+    elif _HAS_AHOCORASICK and len(items) >= _AC_MIN_KEYS:
+        automaton = _build_automaton(items)
+
+        def substitute(segment):
+            return _ac_substitute(segment, automaton)
+    else:
+        ciphers_pattern = _build_pattern(items)
+        transdict = dict(items)
+
+        def lookup(l):
+            return transdict[l[0]]
 
-    # https://regexper.com/#(%5B%5E%3C%5C%5B%23%5D*)(((%3F%3A%3C%5B%5E%3E%5D*%3E)%7C(%3F%3A%5C%5B%5B%5E%5C%5D%5D*%5C%5D))*(%23.*%24)%3F)
-    regex = r'([^<\[#]*)(((?:<[^>]*>)|(?:\[[^\]]*\]))*(#.*$)?)'
+        def substitute(segment):
+            return ciphers_pattern.sub(lookup, segment)
 
-    # Decode the text by splitting the string into the part to be translated (group 0)
-    # and the part to be ignored (cleartext and comments) (group 1).
-    # In the first group, each key from the dictionary is replaced by the corresponding value.
-    # The result is then concatenated with the unchanged second group.
-    output = ''
-    for match in re.findall(regex, text, flags=re.MULTILINE):
-        output += ciphers_pattern.sub(
-            lambda l: transdict[l.group()], match[0]) + match[1]
-    return output
+    # Recurring segments (e.g. the text between two tags on consecutive lines) are only translated once
+    substitute = functools.lru_cache(maxsize=None)(substitute)
+
+    # Decode the text by splitting the string into parts to be translated and parts to be ignored
+    # (cleartext and comments). In the former, each key from the dictionary is replaced by the corresponding value.
+    # The result is then concatenated with the unchanged parts.
+    parts = []
+    for translatable, start, end in _segment(text):
+        segment = text[start:end]
+        parts.append(substitute(segment) if translatable else segment)
+    return ''.join(parts)
 
 
 def remove_comments(text: str) -> str:
@@ -134,21 +321,43 @@ def remove_comments(text: str) -> str:
     :param text:    Input text
     :return:        Text without comments
     """
-    return re.sub('(^[ \t]*#.*\n)|(#.*$)', '', text, flags=re.MULTILINE)
+    if '#' not in text:
+        return text
+    return _COMMENT_RE.sub('', text)
 
 
 def remove_tags(text: str) -> str:
     """
     Removes tags and extracts text inside square brackets [] and angle brackets <>.
-    Also removes 'cleartext' 'CLEARTEXT' or 'Cleartext' as well as language attributes
+    Also removes 'cleartext' (case insensitive) as well as language attributes
     (2 letter uppercase sequences following 'cleartext' and space(s) or dash(es)).
 
     :param text:    Input text
     :return:        Text with tags removed and text extracted
     """
-    return re.sub(
-        r'(?:(<[ ]*(?:(?:cleartext|CLEARTEXT|Cleartext)(?:[ -][A-Z]{2})?[ -]*)?)|(\[))((?(1)[^>]*|[^\]]*))(?(1)>|\])',
-        r'\3', text, flags=re.MULTILINE)
+    if not ('<' in text or '[' in text):
+        return text
+    return _TAG_RE.sub(r'\1\2', text)
+
+
+@functools.lru_cache(maxsize=1)
+def _scan_program_fonts(path: str, mtime: int) -> dict:
+    """
+    Returns the font files in the fonts/ directory (subdirectories are not searched).
+    Cached on the absolute path and modification time of the directory,
+    so it is only scanned again when fonts are added or removed or a different fonts/ directory is used.
+
+    :param path:    absolute path of the fonts/ directory
+    :param mtime:   modification time of the fonts/ directory (ns)
+    :return:        dictionary of font name (uppercase, without extension) -> font file path
+    """
+
+    program_fonts = {}
+    with os.scandir(_FONTS_DIR) as entries:
+        for entry in entries:
+            if entry.is_file() and (entry.name.endswith('.ttf') or entry.name.endswith('.otf')):
+                program_fonts[entry.name[:-4].upper()] = entry.path
+    return program_fonts
 
 
 def create_pdf(text: str, output_file: str, font_type: str, font_size: int,
@@ -166,14 +375,10 @@ def create_pdf(text: str, output_file: str, font_type: str, font_size: int,
     :return:            None
     """
 
-    # Install reportlab if not installed
-    try:
-        import reportlab
-    except ImportError:
-        import pip
-        pip.main(['install', 'reportlab', '--user'])
-        import reportlab
+    if not _HAS_REPORTLAB:
+        raise RuntimeError('Error: Creating pdf files requires reportlab, install it using "pip install reportlab".')
 
+    import reportlab
     from reportlab.pdfgen import canvas
     from reportlab.pdfbase import pdfmetrics
     from reportlab.pdfbase.ttfonts import TTFont
@@ -183,17 +388,16 @@ def create_pdf(text: str, output_file: str, font_type: str, font_size: int,
     from reportlab.platypus.flowables import KeepInFrame
     from reportlab.lib import pagesizes
 
-    canvas = canvas.Canvas(output_file, pagesize=pagesizes.A4)
+    canvas = canvas.Canvas(output_file, pagesize=pagesizes.A4, pageCompression=1, invariant=1)
 
     # Get default fonts into a dictionary
     default_fonts = {font.upper(): font for font in canvas.getAvailableFonts()}
 
     # Get fonts in fonts/ directory into a dictionary
-    program_fonts = {}
-    for root, dirs, files in os.walk("fonts/"):
-        for file in files:
-            if file.endswith('.ttf') or file.endswith('.otf'):
-                program_fonts[re.sub('\.[ot]tf$', '', file).upper()] = os.path.join(root, file)
+    try:
+        program_fonts = _scan_program_fonts(os.path.abspath(_FONTS_DIR), os.stat(_FONTS_DIR).st_mtime_ns)
+    except OSError:
+        program_fonts = {}
 
     # Try to register font if not one of the defaults, fails otherwise
     try:
@@ -241,14 +445,14 @@ def create_pdf(text: str, output_file: str, font_type: str, font_size: int,
 
     # Pagination
     # Pages are split on empty lines (can contain whitespace)
-    pages = re.split('(?:[\n][ \t]*){2,}', text.strip())
+    pages = _PAGE_SPLIT_RE.split(text.strip())
     for index, page in enumerate(pages):
         frame = KeepInFrame(width, height, [Paragraph(page.replace('\n', '<br/>\n'), stylesheet["custom"])])
         w, h = frame.wrapOn(canvas, width, height)
         frame.drawOn(canvas, tlx, tly - h)
 
         # Insert page break for all but the last page
-        if index != len(pages):
+        if index != len(pages) - 1:
             canvas.showPage()
 
     # Produce pdf
@@ -295,7 +499,11 @@ def main() -> None:
         write_file(output_file + '.txt', output)
 
     if args.pdf:
-        create_pdf(output, output_file + '.pdf', args.font_type, args.font_size)
+        try:
+            create_pdf(output, output_file + '.pdf', args.font_type, args.font_size)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
 
     if args.console:
         print(output)
@@ -2,12 +2,28 @@
 Test cases for decode
 """
 
-from unittest import TestCase
+import os
+import tempfile
+from unittest import TestCase, mock, skipUnless
 
 import decode
 
 
 class TestDecode(TestCase):
+    def test_read_file(self):
+        cases = [('LF', 'a\nb\n', 'a{0}b{0}'),
+                 ('CRLF', 'a\r\nb\r\n', 'a{0}b{0}'),
+                 ('Repeated carriage returns', 'a\r\r\nb\r\n\r\nc', 'a{0}b{0}{0}c'),
+                 ('Lone carriage return', 'a\rb\nc', 'a\rb{0}c')]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'input.txt')
+            for name, data, expected in cases:
+                with self.subTest(name):
+                    with open(filename, 'w', encoding='utf-8', newline='') as f:
+                        f.write(data)
+                    self.assertEquals(decode.read_file(filename), expected.format(os.linesep),
+                                      'Line breaks not handled correctly.')
+
     def test_get_dictionary(self):
         with self.subTest('Basic functionality'):
             dic = decode.get_dictionary('a/b\nc/d\ne/f', False)
@@ -18,12 +34,24 @@ class TestDecode(TestCase):
         with self.subTest('Empty lines'):
             dic = decode.get_dictionary('\na/b\n\n\nc/d\ne/f\n\n', False)
             self.assertEquals(dic, {'a': 'b', 'c': 'd', 'e': 'f'}, 'Empty lines not handled correctly.')
+        with self.subTest('Other line boundaries'):
+            dic = decode.get_dictionary('a/b\rc/d\r\ne/f\x0bg/h\u2028i/j\x85k/l', False)
+            self.assertEquals(dic, {'a': 'b', 'c': 'd', 'e': 'f', 'g': 'h', 'i': 'j', 'k': 'l'},
+                              'Line boundaries other than \\n not handled correctly.')
+        with self.subTest('Malformed lines'):
+            dic = decode.get_dictionary('a/b\nc/d/e\n #f/g\nh #i/j', False)
+            self.assertEquals(dic, {'a': 'b'}, 'Lines without exactly one delimiter not ignored.')
+        with self.subTest('Long lines without key-value pair'):
+            dic = decode.get_dictionary('a/b\n' + ' ' * 5000 + '\n' + '\t' * 5000 + '\nx/' + ' ' * 5000 + 'y/z', False)
+            self.assertEquals(dic, {'a': 'b'}, 'Long lines without key-value pair not handled correctly.')
         with self.subTest('Empty dictionary'):
             with self.assertRaises(ValueError, msg='Dictionary with no key-value pairs should raise a ValueError'):
                 decode.get_dictionary('#a/b\ncccc\ne|f\ng:h', False)
         with self.subTest('Reverse'):
             dic = decode.get_dictionary('a/b\nc/d\ne/f', True)
             self.assertEquals(dic, {'b': 'a', 'd': 'c', 'f': 'e'}, 'Dictionary reverse not working.')
+            dic = decode.get_dictionary('a/x\na/y\nc/d', True)
+            self.assertEquals(dic, {'y': 'a', 'd': 'c'}, 'Reversed dictionary is not the inverse of the dictionary.')
         with self.subTest('String strip'):
             dic = decode.get_dictionary(' a/b  \nc /d\ne  /  f\t', False)
             self.assertEquals(dic, {'a': 'b', 'c': 'd', 'e': 'f'}, 'String stripping not working.')
@@ -33,6 +61,10 @@ class TestDecode(TestCase):
         with self.subTest('Escaped unicode'):
             dic = decode.get_dictionary('\\u1234/\\U0001F73A\n\\N{pisces}/\\u2644\n\\u3210/\\u4444', False)
             self.assertEquals(dic, {'ሴ': '🜺', '㈐': '䑄', '♓': '♄'}, 'Escaped unicode characters not handled correctly.')
+        with self.subTest('Repeated parsing'):
+            decode.get_dictionary('a/b\nc/d', False)['e'] = 'f'
+            dic = decode.get_dictionary('a/b\nc/d', False)
+            self.assertEquals(dic, {'a': 'b', 'c': 'd'}, 'Changes to a returned dictionary affect later calls.')
 
     def test_translate(self):
         with self.subTest('Basic functionality'):
@@ -54,6 +86,14 @@ class TestDecode(TestCase):
             for n in range(1, 10):  # Run several times as dict ordering can potentially be random
                 trans = decode.translate('abcabc', {'bc': 'Q', 'ab': 'Y', 'abc': 'X', 'a': 'f', 'b': 'g'})
                 self.assertEquals(trans, 'XX', 'Longer keys not processed before shorter ones.')
+        with self.subTest('Shorter key inside partial match of longer key'):
+            trans = decode.translate('abcab', {'abcd': 'X', 'c': 'Y', 'bcab': 'Z'})
+            self.assertEquals(trans, 'aZ', 'Shorter keys inside longer partial matches not processed correctly.')
+            trans = decode.translate('bc', {'bca': 'X', 'c': 'Y'})
+            self.assertEquals(trans, 'bY', 'Shorter keys inside longer partial matches not processed correctly.')
+        with self.subTest('Single character keys'):
+            trans = decode.translate('abc#a\n<a>a', {'a': 'xy', 'b': '', 'c': 'a'})
+            self.assertEquals(trans, 'xya#a\n<a>xy', 'Single character keys not processed correctly.')
         with self.subTest('Unicode'):
             trans = decode.translate('aሴb㈐c\nd♓efľőêèå', {'ሴ': '🜺', '㈐': '䑄', '♓': '♄'})
             self.assertEquals(trans, 'a🜺b䑄c\nd♄efľőêèå', 'Unicode characters not handled correctly.')
@@ -61,6 +101,18 @@ class TestDecode(TestCase):
             trans = decode.translate('#c\na[a]<a>a[a][a]#a\n<a>[a]a<a>a#a', {'a': 'b'})
             self.assertEquals(trans, '#c\nb[a]<a>b[a][a]#a\n<a>[a]b<a>b#a',
                               'Multiple comments/tags in one line not processed correctly.')
+        with self.subTest('Unclosed tags'):
+            trans = decode.translate('a<a\n[a]a[a', {'a': 'b'})
+            self.assertEquals(trans, 'b<b\n[a]b[b', 'Unclosed tags not processed as ordinary text.')
+        with self.subTest('Regex special characters in keys'):
+            trans = decode.translate('a.b*c.*', {'.': 'x', '*': 'y', 'a': 'z', '.*': 'w'})
+            self.assertEquals(trans, 'zxbycw', 'Keys are not matched literally.')
+        with self.subTest('Modified dictionary'):
+            dictionary = {'a': 'b'}
+            self.assertEquals(decode.translate('abc', dictionary), 'bbc')
+            dictionary['c'] = 'd'
+            self.assertEquals(decode.translate('abc', dictionary), 'bbd',
+                              'Cached translation reused after the dictionary was modified.')
 
     def test_remove_comments(self):
         with self.subTest('Text without comments'):
@@ -96,8 +148,35 @@ class TestDecode(TestCase):
         with self.subTest('Tags <cleartext ...>'):
             self.assertEquals('text', decode.remove_tags('<cleartext -text>'),
                               'Case insensitive removal of "<cleartext" tags not handled correctly')
+            self.assertEquals('text', decode.remove_tags('<ClearText -text>'),
+                              'Case insensitive removal of "<cleartext" tags not handled correctly')
         with self.subTest('Removing language attributes'):
             self.assertEquals('text', decode.remove_tags('<cleartext-LA text>'), 'Language tags not removed correctly')
+        with self.subTest('Nested tags'):
+            self.assertEquals('[a]<b>', decode.remove_tags('<[a]>[<b>]'), 'Tags inside tags not kept')
         with self.subTest('Not removing text similar to language attributes'):
             self.assertEquals('te xt', decode.remove_tags('<cleartext-te xt>'),
                               'Language tags incorrectly identified and removed')
+
+    @skipUnless(decode._HAS_AHOCORASICK, 'pyahocorasick not installed')
+    def test_translate_automaton(self):
+        cases = [('abcabc', {'bc': 'Q', 'ab': 'Y', 'abc': 'X', 'a': 'f', 'b': 'g'}),
+                 ('abcab\nbc', {'abcd': 'X', 'c': 'Y', 'bcab': 'Z', 'bca': 'W'}),
+                 ('#c\na[a]<a>a[a][a]#a\n<a>[a]a<a>a#a', {'a': 'b', 'ab': 'c'}),
+                 ('aሴb㈐c\nd♓efľőêèå', {'ሴ': '🜺', '㈐': '䑄', '♓': '♄', 'ef': 'x'}),
+                 ('a.b*c<a.*', {'.': 'x', '*': 'y', 'a': 'z', '.*': 'w'})]
+        for text, dictionary in cases:
+            with self.subTest(text=text):
+                decode._translate.cache_clear()
+                expected = decode.translate(text, dictionary)
+                decode._translate.cache_clear()
+                with mock.patch.object(decode, '_AC_MIN_KEYS', 0):
+                    self.assertEquals(decode.translate(text, dictionary), expected,
+                                      'Aho-Corasick and regex translations differ.')
+
+    def test_translate_table(self):
+        # A multi-character key that never matches keeps the same dictionary off the str.translate path
+        text = '#c\na[a]<a>a.b*c\nabcሴ#a\n<a>[a]a<a'
+        dictionary = {'a': 'bc', 'b': '', 'c': 'a', '.': '*', 'ሴ': '🜺'}
+        self.assertEquals(decode.translate(text, dictionary), decode.translate(text, {**dictionary, '\0\0': ''}),
+                          'Translation table and regex translations differ.')